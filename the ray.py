@@ -4,22 +4,35 @@ import random
 
 class Enemy():
     """A red object falling from above that The Ray has to destroy."""
-    def __init__(self, canvas: tk.Canvas, 
-                 health: int, speed: int, spawn_x: int) -> None:
-        """Creates an enemy.
+    __slots__ = ('_canvas', '_health', '_speed', '_fall', '_x', '_y', '_id')
+
+    def __init__(self, canvas: tk.Canvas, pool: list[int], 
+                 health: int, speed: float, spawn_x: int) -> None:
+        """Creates an enemy, reusing a hidden rectangle from the pool if one
+        is available.
         
         Parameters:
             canvas (tk.Canvas): The canvas that the enemy is in.
+            pool (list[int]): The ids of hidden rectangles on the canvas that
+                are free to reuse.
             health (int): The starting health of the enemy.
-            speed (int): The speed at which the enemy falls.
+            speed (float): The distance the enemy falls per movement tick.
             spawn_x (int): The x-coordinate where the enemy spawns.
         """
         self._canvas = canvas
         self._health = health
         self._speed = speed
-        self._position = (spawn_x, 0)
-        self._id = self._canvas.create_rectangle(spawn_x - 5, -5, 
-                                                 spawn_x + 5, 5, fill="red")
+        self._fall = 0.0
+        self._x = spawn_x
+        self._y = 0
+        if pool:
+            self._id = pool.pop()
+            self._canvas.coords(self._id, spawn_x - 5, -5, spawn_x + 5, 5)
+            self._canvas.itemconfigure(self._id, state=tk.NORMAL)
+        else:
+            self._id = self._canvas.create_rectangle(spawn_x - 5, -5, 
+                                                     spawn_x + 5, 5, 
+                                                     fill="red")
 
     def is_alive(self) -> bool:
         """(bool): Returns true if enemy is alive."""
@@ -31,22 +44,128 @@ class Enemy():
 
     def get_position(self) -> tuple[int, int]:
         """(tuple[int, int]: Returns the coordinate position of the enemy."""
-        return self._position
+        return (self._x, self._y)
 
     def damage(self, damage: int) -> None:
-        """Damages the enemy.
+        """Damages the enemy. The caller is responsible for removing the
+        enemy from the canvas once it is dead.
         
         Parameters:
             damage (int): The amount of damage dealt.
         """
         self._health -= damage
-        if self._health <= 0:
-            self._canvas.delete(self._id)
     
-    def move(self) -> None:
-        """Moves the enemy downwards."""
-        self._position = (self._position[0], self._position[1] + self._speed)
-        self._canvas.move(self._id, 0, self._speed)
+    def move(self) -> int:
+        """Moves the enemy downwards by a whole number of pixels, carrying
+        any fraction of its speed over to the next move. The caller is
+        responsible for moving the enemy on the canvas.
+
+        Returns:
+            (int): The number of pixels the enemy moved.
+        """
+        self._fall += self._speed
+        distance = int(self._fall)
+        self._fall -= distance
+        self._y += distance
+        return distance
+
+
+class Quadtree():
+    """A point-region quadtree of enemy positions, for finding the enemies
+    inside a rectangular area."""
+    _capacity = 4
+    _max_depth = 8
+
+    def __init__(self, x0: int, y0: int, x1: int, y1: int, 
+                 depth: int = 0) -> None:
+        """Creates an empty quadtree covering the given area. Positions
+        inserted into the tree must lie inside this area.
+        
+        Parameters:
+            x0 (int): The left edge of the area.
+            y0 (int): The top edge of the area.
+            x1 (int): The right edge of the area.
+            y1 (int): The bottom edge of the area.
+            depth (int): The depth of this node in the tree.
+        """
+        self._bounds = (x0, y0, x1, y1)
+        self._depth = depth
+        self._items = []
+        self._children = None
+
+    def insert(self, enemy: Enemy, x: int, y: int) -> None:
+        """Adds an enemy to the tree.
+        
+        Parameters:
+            enemy (Enemy): The enemy to add.
+            x (int): The x-coordinate of the enemy.
+            y (int): The y-coordinate of the enemy.
+        """
+        if self._children is not None:
+            self._child_at(x, y).insert(enemy, x, y)
+            return
+
+        self._items.append((enemy, x, y))
+        if (len(self._items) > self._capacity 
+                and self._depth < self._max_depth):
+            x0, y0, x1, y1 = self._bounds
+            mid_x = (x0 + x1) // 2
+            mid_y = (y0 + y1) // 2
+            depth = self._depth + 1
+            self._children = [Quadtree(x0, y0, mid_x, mid_y, depth), 
+                              Quadtree(mid_x, y0, x1, mid_y, depth), 
+                              Quadtree(x0, mid_y, mid_x, y1, depth), 
+                              Quadtree(mid_x, mid_y, x1, y1, depth)]
+            for item in self._items:
+                self._child_at(item[1], item[2]).insert(*item)
+            self._items = []
+
+    def remove(self, enemy: Enemy, x: int, y: int) -> None:
+        """Removes an enemy from the tree.
+        
+        Parameters:
+            enemy (Enemy): The enemy to remove.
+            x (int): The x-coordinate the enemy was inserted with.
+            y (int): The y-coordinate the enemy was inserted with.
+        """
+        node = self
+        while node._children is not None:
+            node = node._child_at(x, y)
+        node._items.remove((enemy, x, y))
+
+    def query(self, x0: int, y0: int, x1: int, y1: int
+              ) -> list[tuple[Enemy, int, int]]:
+        """Finds the enemies inside the given area, including its edges.
+        
+        Parameters:
+            x0 (int): The left edge of the area.
+            y0 (int): The top edge of the area.
+            x1 (int): The right edge of the area.
+            y1 (int): The bottom edge of the area.
+
+        Returns:
+            (list[tuple[Enemy, int, int]]): The enemies found, each with its
+                x- and y-coordinates.
+        """
+        found = []
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            left, top, right, bottom = node._bounds
+            if left > x1 or right < x0 or top > y1 or bottom < y0:
+                continue
+            if node._children is not None:
+                nodes.extend(node._children)
+            else:
+                found.extend(item for item in node._items 
+                             if x0 <= item[1] <= x1 and y0 <= item[2] <= y1)
+        return found
+
+    def _child_at(self, x: int, y: int) -> 'Quadtree':
+        """(Quadtree): Returns the child node containing the given position."""
+        x0, y0, x1, y1 = self._bounds
+        return self._children[(x >= (x0 + x1) // 2) 
+                              + 2 * (y >= (y0 + y1) // 2)]
 
 
 class InfoFrame(tk.Frame):
@@ -87,6 +206,12 @@ class TheRay():
     _size = 500
     _origin = (_size // 2, _size)
     _shadow_origin = (_size // 2 + 2, _size + 2)
+    _hit_range = 7  # enemy half-width (5) + ray thickness (2)
+    _tick = 16  # milliseconds between enemy movements, about 60 per second
+    _pool_size = 20  # twice the number of enemies spawned per level
+    # level: (enemy speed, spawn delay in milliseconds), for the early levels
+    _level_params = {1: (1, 1000), 2: (2, 800), 3: (2, 800), 
+                     4: (3, 800), 5: (3, 800)}
     
     def __init__(self, root: tk.Tk) -> None:
         """Creates The Ray.
@@ -100,6 +225,7 @@ class TheRay():
 
         self._id = None
         self._shadow_id = None
+        self._ray_visible = False
 
         self._canvas = tk.Canvas(root, bg="black", bd=2, relief=tk.SUNKEN)
         self._canvas.pack(side=tk.TOP, expand=True, fill=tk.BOTH)
@@ -111,6 +237,9 @@ class TheRay():
         self._scheduled_movement = None
         self._scheduled_spawn = None
         self._enemies = []
+        self._enemy_tree = Quadtree(0, 0, self._size, self._size)
+        self._rect_pool = []
+        self._pending_releases = []
         self._enemy_count = 0
 
         self._canvas.bind('<B1-Motion>', self.evt_click_motion)
@@ -121,6 +250,7 @@ class TheRay():
     def start_click(self) -> None:
         """Initializes the title screen."""
         self._canvas.delete(tk.ALL)
+        self.create_ray()
 
         self._canvas.create_text(252, 252, text="THE RAY", fill="white", 
                                  font=("STHupo", 50, "bold"))
@@ -130,34 +260,95 @@ class TheRay():
                                  font=("Times", 15, "bold"))
         self._canvas.bind('<Button-1>', self.restart)
 
+    def create_ray(self) -> None:
+        """Creates the line items for The Ray, hidden until it is used."""
+        self._shadow_id = self._canvas.create_line(self._shadow_origin, 
+                                                   self._shadow_origin, 
+                                                   width=3, fill="#ff8282", 
+                                                   state=tk.HIDDEN, tags="ray")
+        self._id = self._canvas.create_line(self._origin, self._origin, 
+                                            width=3, fill="red", 
+                                            state=tk.HIDDEN, tags="ray")
+        self._ray_visible = False
+
+    def create_rect_pool(self) -> None:
+        """Creates hidden rectangles for enemies to reuse."""
+        self._rect_pool = [self._canvas.create_rectangle(-5, -5, 5, 5, 
+                                                         fill="red", 
+                                                         state=tk.HIDDEN)
+                           for _ in range(self._pool_size)]
+
+    def release_rectangles(self, ids: list[int]) -> None:
+        """Hides enemy rectangles and returns them to the pool.
+        
+        Parameters:
+            ids (list[int]): The ids of the rectangles to release.
+        """
+        if ids:
+            self._canvas.tk.eval("\n".join(
+                f"{self._canvas} itemconfigure {id_} -state hidden" 
+                for id_ in ids))
+            self._rect_pool.extend(ids)
+
     def evt_click_motion(self, event) -> None:
         """Handles click and drag events."""
         self._x = event.x
         self._y = event.y
 
-        self._canvas.delete(self._id)
-        self._canvas.delete(self._shadow_id)
-
-        line_points = list(self.bresenham_line(self._origin[0], self._origin[1],
-                                               self._x, self._y))
-        self.attack(line_points)
+        # only the part of The Ray inside the canvas can hit enemies
+        end = self.clip_to_canvas(self._x, self._y)
+        if end != self._origin:
+            xs, ys = self.bresenham_line(*self._origin, *end)
+            self.attack(xs, ys)
         # bug - only deals damage when The Ray moves
 
-        self._shadow_id = self._canvas.create_line(self._shadow_origin, 
-                                                   (self._x + 2, self._y + 2), 
-                                                   width=3, fill="#ff8282")
-        self._id = self._canvas.create_line(self._origin, 
-                                            (self._x, self._y), 
-                                            width=3, fill="red")
+        self._canvas.coords(self._shadow_id, *self._shadow_origin, 
+                            self._x + 2, self._y + 2)
+        self._canvas.coords(self._id, *self._origin, self._x, self._y)
+        if not self._ray_visible:
+            self._canvas.itemconfigure("ray", state=tk.NORMAL)
+            self._canvas.tag_raise("ray")
+            self._ray_visible = True
 
     def evt_release(self, event=None) -> None:
         """Handles release events."""
-        self._canvas.delete(self._id)
-        self._canvas.delete(self._shadow_id)
+        self._canvas.itemconfigure("ray", state=tk.HIDDEN)
+        self._ray_visible = False
 
-    def bresenham_line(self, x0: int, y0: int, x1: int, y1: int):
-        """Generate integer coordinates on the line from (x0, y0) to (x1, y1)
-        using Bresenham's algorithm.
+    def clip_to_canvas(self, x: int, y: int) -> tuple[int, int]:
+        """Clips the line from The Ray's origin to (x, y) to the canvas.
+        
+        Parameters:
+            x (int): The x-coordinate of the end of the line.
+            y (int): The y-coordinate of the end of the line.
+
+        Returns:
+            (tuple[int, int]): The end of the part of the line that is
+                inside the canvas.
+        """
+        x0, y0 = self._origin
+        t = 1.0
+        if x < 0:
+            t = min(t, x0 / (x0 - x))
+        elif x > self._size:
+            t = min(t, (self._size - x0) / (x - x0))
+        if y < 0:
+            t = min(t, y0 / (y0 - y))
+        elif y > self._size:
+            t = min(t, (self._size - y0) / (y - y0))
+        if t == 1.0:
+            return x, y
+        return round(x0 + t * (x - x0)), round(y0 + t * (y - y0))
+
+    def bresenham_line(self, x0: int, y0: int, x1: int, y1: int
+                       ) -> tuple[list[int], list[int]]:
+        """Generate integer coordinates on the line from (x0, y0) to (x1, y1).
+
+        The line is stepped one pixel at a time along its major axis, with
+        the minor coordinate rounded to the nearest pixel. This gives the
+        same pixels as Bresenham's algorithm, except where the minor
+        coordinate lands exactly halfway between two pixels, which is always
+        rounded up here.
         
         Parameters:
             x0 (int): Initial x-coordinate.
@@ -166,47 +357,42 @@ class TheRay():
             y1 (int): Final y-coordinate.
 
         Returns:
-            An iterator that yields tuples of integers.
+            (tuple[list[int], list[int]]): The x-coordinates and the
+                y-coordinates of the points on the line, in order.
         """
-        dx = abs(x1 - x0)
-        dy = -abs(y1 - y0)
-        sx = 1 if x0 < x1 else -1
-        sy = 1 if y0 < y1 else -1
-        err = dx + dy
-        while True:
-            yield (x0, y0)
-            if x0 == x1 and y0 == y1:
-                break
-            e2 = 2 * err
-            if e2 >= dy:
-                err += dy
-                x0 += sx
-            if e2 <= dx:
-                err += dx
-                y0 += sy
+        dx = x1 - x0
+        dy = y1 - y0
+        n = max(abs(dx), abs(dy))
+        if n == 0:
+            return [x0], [y0]
+
+        # rounds i * d / n to the nearest integer, using integer arithmetic
+        if abs(dx) >= abs(dy):
+            xs = list(range(x0, x1 + (1 if dx > 0 else -1), 
+                            1 if dx > 0 else -1))
+            ys = [y0 + (2 * i * dy + n) // (2 * n) for i in range(n + 1)]
+        else:
+            xs = [x0 + (2 * i * dx + n) // (2 * n) for i in range(n + 1)]
+            ys = list(range(y0, y1 + (1 if dy > 0 else -1), 
+                            1 if dy > 0 else -1))
+        return xs, ys
 
     def schedule_enemy_spawn(self) -> None:
         """Spawns enemies automatically, and ends the level when all enemies
         are dead."""
         if self._game:
-            if self._level == 1:
-                enemy_speed = 1
-                spawn_delay = 1000
-            elif self._level in [2, 3]:
-                enemy_speed = 2
-                spawn_delay = 800
-            elif self._level in [4, 5]:
-                enemy_speed = 3
-                spawn_delay = 800
-            else:
-                enemy_speed = self._level // 2 + 1
-                spawn_delay = 700
+            enemy_speed, spawn_delay = self._level_params.get(
+                self._level, (self._level // 2 + 1, 700))
 
             if self._enemy_count < 10:
                 spawn_x = random.randint(10, 490)
-                new_enemy = Enemy(self._canvas, health=1, speed=enemy_speed, 
-                                spawn_x=spawn_x)
+                # enemy speeds are given in pixels per 10 milliseconds
+                new_enemy = Enemy(self._canvas, self._rect_pool, health=1, 
+                                  speed=enemy_speed * self._tick / 10, 
+                                  spawn_x=spawn_x)
                 self._enemies.append(new_enemy)
+                # make the enemy hittable before the next movement tick
+                self._enemy_tree.insert(new_enemy, *new_enemy.get_position())
                 self._enemy_count += 1
                 self._scheduled_spawn = self._root.after(spawn_delay, 
                                                         self.schedule_enemy_spawn)
@@ -234,44 +420,110 @@ class TheRay():
 
     def schedule_enemy_movement(self) -> None:
         """Makes all enemies move automatically."""
+        # move all enemies on the canvas with a single Tcl evaluation, and
+        # drop enemies that have died or reached the bottom
+        moves = []
+        remaining = []
+        escaped = 0
+        self._enemy_tree = Quadtree(0, 0, self._size, self._size)
+
+        # look up the canvas path, append methods and tree insert once,
+        # rather than once per enemy
+        canvas_path = str(self._canvas)
+        add_move = moves.append
+        keep = remaining.append
+        release = self._pending_releases.append
+        insert = self._enemy_tree.insert
         for enemy in self._enemies:
-            enemy.move()
-            if enemy.is_alive() and enemy.get_position()[1] >= 500:
-                self._enemies.remove(enemy)
-                self._lives -= 1
-                self._info.update_lives(self._lives)
-                if self._lives <= 0:
-                    self._lives = 0
-                    self.game_over()
-                    return
-
-        self._scheduled_movement = self._root.after(10, self.schedule_enemy_movement)
-
-    def attack(self, target_positions: list[tuple[int, int]]) -> None:
+            if not enemy.is_alive():
+                continue
+            distance = enemy.move()
+            if distance:
+                add_move(f"{canvas_path} move {enemy.get_id()} 0 {distance}")
+            x, y = enemy.get_position()
+            if y >= 500:
+                release(enemy.get_id())
+                escaped += 1
+            else:
+                keep(enemy)
+                insert(enemy, x, y)
+        self._enemies = remaining
+
+        if moves:
+            self._canvas.tk.eval("\n".join(moves))
+        # hide enemies removed since the last tick in one Tcl evaluation
+        if self._pending_releases:
+            self.release_rectangles(self._pending_releases)
+            self._pending_releases.clear()
+
+        if escaped:
+            self._lives = max(self._lives - escaped, 0)
+            self._info.update_lives(self._lives)
+            if self._lives <= 0:
+                self.game_over()
+                return
+
+        self._scheduled_movement = self._root.after(self._tick, 
+                                                    self.queue_enemy_movement)
+
+    def queue_enemy_movement(self) -> None:
+        """Runs the next enemy movement once pending events are handled, so
+        that movement does not delay The Ray's response to the mouse."""
+        self._scheduled_movement = self._root.after_idle(
+            self.schedule_enemy_movement)
+
+    def attack(self, xs: list[int], ys: list[int]) -> None:
         """Attacks all enemies on the given positions.
         
         Parameters:
-            target_positions (list[tuple[int, int]]): A list of coordinates
-                to attack.
+            xs (list[int]): The x-coordinates of the positions to attack.
+            ys (list[int]): The y-coordinates of the positions to attack.
         """
-        enemy_dict = {}
-        for enemy in self._enemies:
-            enemy_dict[enemy.get_position()] = enemy
-        
-        for x, y in target_positions:
-            # check the target position and some adjacent positions
-            for x_add in range(-2, 3):
-                for y_add in range(-2, 3):
-                    attack_pos = (x + x_add, y + y_add)
-                    if attack_pos in enemy_dict:
-                        enemy_dict[attack_pos].damage(1)
+        # the line has exactly one point per coordinate along its major
+        # axis, so only the points within range of an enemy along that axis
+        # need to be checked
+        if abs(xs[-1] - xs[0]) >= abs(ys[-1] - ys[0]):
+            major, minor = xs, ys
+        else:
+            major, minor = ys, xs
+        start = major[0]
+        step = 1 if major[-1] >= start else -1
+        last = len(major) - 1
+
+        r = self._hit_range
+        tree = self._enemy_tree
+        release = self._pending_releases.append
+        x_major = xs is major
+
+        nearby = tree.query(min(xs[0], xs[-1]) - r, min(ys[0], ys[-1]) - r, 
+                            max(xs[0], xs[-1]) + r, max(ys[0], ys[-1]) + r)
+        for enemy, x, y in nearby:
+            if x_major:
+                enemy_major, enemy_minor = x, y
+            else:
+                enemy_major, enemy_minor = y, x
+            i = (enemy_major - r - start) * step
+            j = (enemy_major + r - start) * step
+            for k in range(max(min(i, j), 0), min(max(i, j), last) + 1):
+                if abs(minor[k] - enemy_minor) <= r:
+                    enemy.damage(1)
+                    if not enemy.is_alive():
+                        # stop later attacks this tick from finding it
+                        tree.remove(enemy, x, y)
+                        release(enemy.get_id())
+                    break
 
     def game_over(self) -> None:
         """Handles game over."""
         self._game = False
-        for enemy in self._enemies:
-            self._canvas.delete(enemy.get_id())
+        # dead enemies are already waiting to be released
+        self._pending_releases.extend(enemy.get_id() 
+                                      for enemy in self._enemies 
+                                      if enemy.is_alive())
+        self.release_rectangles(self._pending_releases)
+        self._pending_releases.clear()
         self._enemies.clear()
+        self._enemy_tree = Quadtree(0, 0, self._size, self._size)
 
         self._lose_text_1 = self._canvas.create_text(252, 252, text="YOU LOSE", 
                                                      fill="white", 
@@ -285,6 +537,7 @@ class TheRay():
     def restart_click(self) -> None:
         """Initializes the restart screen."""
         self._canvas.delete(tk.ALL)
+        self.create_ray()
 
         self._canvas.create_text(252, 252, text="THE RAY", fill="white", 
                                  font=("STHupo", 50, "bold"))
@@ -299,6 +552,8 @@ class TheRay():
         """Handles game start."""
         self._canvas.unbind('<Button-1>')
         self._canvas.delete(tk.ALL)
+        self.create_ray()
+        self.create_rect_pool()
 
         if self._scheduled_movement:
             self._root.after_cancel(self._scheduled_movement)
@@ -310,6 +565,7 @@ class TheRay():
         self._level = 0
         self._enemy_count = 0
         self._enemies.clear()
+        self._pending_releases.clear()
 
         self._info.update_lives(self._lives)
         self.advance_level()